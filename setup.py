@@ -17,6 +17,7 @@ def readme():
 def install_requires():
     """Determine installation requirements."""
     requirements = [
+        "appdirs>=1.4",
         "docopt>=0.6.2",
         "monotonic",
         "requests>=2.0",
@@ -53,6 +54,15 @@ setuptools.setup(
             "sphinx",
             "sphinx_rtd_theme",
         ],
+        "http2": [
+            "httpx[http2]",
+        ],
+        "orjson": [
+            "orjson",
+        ],
+        "simdjson": [
+            "pysimdjson",
+        ],
     },
     license="MIT License",
     classifiers=[
@@ -4,6 +4,8 @@
 from __future__ import (absolute_import,
                         unicode_literals, print_function, division)
 
+import collections
+import inspect
 import re
 import textwrap
 import types
@@ -13,6 +15,8 @@ try:
 except ImportError:
     import unittest.mock as mock
 import pytest
+import six
+from six.moves.urllib.parse import parse_qsl
 
 from valve.steam.api import interface
 
@@ -30,6 +34,72 @@ class TestEnsureIdentifier(object):
             interface._ensure_identifier("12345!£$%^&*()678909")
 
 
+class TestJSONFormat(object):
+
+    def test_stdlib(self, monkeypatch):
+        monkeypatch.setattr(interface, "simdjson", None)
+        monkeypatch.setattr(interface, "orjson", None)
+        assert interface.json_format('{"foo": [1, 2]}') == {"foo": [1, 2]}
+
+    def test_stdlib_bytes(self, monkeypatch):
+        monkeypatch.setattr(interface, "simdjson", None)
+        monkeypatch.setattr(interface, "orjson", None)
+        assert interface.json_format(
+            '{"foo": "Upsid\u00e9"}'.encode("utf-8")) == {"foo": "Upsid\u00e9"}
+
+    def test_orjson(self, monkeypatch):
+        orjson = mock.Mock()
+        monkeypatch.setattr(interface, "simdjson", None)
+        monkeypatch.setattr(interface, "orjson", orjson)
+        assert interface.json_format(b'{}') is orjson.loads.return_value
+        assert orjson.loads.call_args[0] == (b'{}',)
+
+    def test_simdjson(self, monkeypatch):
+        simdjson = mock.Mock()
+        monkeypatch.setattr(interface, "simdjson", simdjson)
+        monkeypatch.setattr(interface, "_SIMDJSON_PARSERS", mock.Mock(spec=[]))
+        parser = simdjson.Parser.return_value
+        assert interface.json_format('{}') is parser.parse.return_value
+        assert interface.json_format('{}') is parser.parse.return_value
+        assert simdjson.Parser.call_count == 1
+        assert parser.parse.call_args[0] == ('{}', True)
+
+
+class TestParameterTypes(object):
+
+    @pytest.mark.parametrize(("validator", "value"), [
+        (interface.uint32, 0),
+        (interface.uint32, 4294967295),
+        (interface.uint64, 0),
+        (interface.uint64, 18446744073709551615),
+        (interface.int32, -2147483648),
+        (interface.int32, 2147483647),
+    ])
+    def test_bounds(self, validator, value):
+        assert validator(value) == value
+        assert validator(str(value)) == value
+
+    @pytest.mark.parametrize(("validator", "value"), [
+        (interface.uint32, -1),
+        (interface.uint32, 4294967296),
+        (interface.uint64, -1),
+        (interface.uint64, 18446744073709551616),
+        (interface.int32, -2147483649),
+        (interface.int32, 2147483648),
+    ])
+    def test_out_of_bounds(self, validator, value):
+        with pytest.raises(ValueError):
+            validator(value)
+
+
+def test_etree_format_bytes():
+    element = interface.etree_format(
+        '<?xml version="1.0" encoding="UTF-8"?><foo>\u00e9</foo>'
+        .encode("utf-8"))
+    assert element.tag == "foo"
+    assert element.text == "\u00e9"
+
+
 def test_make_interfaces(monkeypatch):
     mocks = [mock.Mock(), mock.Mock()]
     mocks_copy = mocks[:]
@@ -64,6 +134,11 @@ def test_make_interfaces(monkeypatch):
 
 class TestMakeInterface(object):
 
+    @pytest.fixture(autouse=True)
+    def empty_cache(self, monkeypatch):
+        monkeypatch.setattr(interface,
+                            "_INTERFACE_CACHE", collections.OrderedDict())
+
     def test_not_pinned(self, monkeypatch):
         mocks = [mock.Mock(), mock.Mock()]
         mocks_copy = mocks[:]
@@ -146,6 +221,128 @@ class TestMakeInterface(object):
             "version": 2,
         }
 
+    def test_cached(self, monkeypatch):
+        method = mock.Mock()
+        method.name = "TestMethod"
+        method.version = 1
+        monkeypatch.setattr(interface,
+                            "make_method", mock.Mock(return_value=method))
+        spec = {
+            "name": "TestInterfaceOne",
+            "methods": [
+                {
+                    "name": "TestMethod",
+                    "version": 1,
+                },
+            ],
+        }
+        iface = interface.make_interface(spec, {})
+        assert interface.make_interface(spec, {}) is iface
+        assert interface.make_method.call_count == 1
+        assert interface.make_interface(spec, {"TestMethod": 1}) is not iface
+        assert interface.make_method.call_count == 2
+
+    def test_cached_httpmethod(self, monkeypatch):
+        method = mock.Mock()
+        method.name = "TestMethod"
+        method.version = 1
+        monkeypatch.setattr(interface,
+                            "make_method", mock.Mock(return_value=method))
+
+        def spec(http_method):
+            return {
+                "name": "TestInterfaceOne",
+                "methods": [
+                    {
+                        "name": "TestMethod",
+                        "version": 1,
+                        "httpmethod": http_method,
+                    },
+                ],
+            }
+
+        iface = interface.make_interface(spec("GET"), {})
+        assert interface.make_interface(spec("POST"), {}) is not iface
+        assert interface.make_method.call_count == 2
+
+    def test_cached_pinned_warning(self, monkeypatch):
+        mocks = [mock.Mock(), mock.Mock()]
+        mocks[0].name = "TestMethod"
+        mocks[0].version = 1
+        mocks[1].name = "TestMethod"
+        mocks[1].version = 2
+        monkeypatch.setattr(interface,
+                            "make_method",
+                            mock.Mock(side_effect=lambda *args: mocks.pop(0)))
+        spec = {
+            "name": "TestInterfaceOne",
+            "methods": [
+                {
+                    "name": "TestMethod",
+                    "version": 1,
+                },
+                {
+                    "name": "TestMethod",
+                    "version": 2,
+                },
+            ],
+        }
+        with pytest.warns(FutureWarning):
+            iface = interface.make_interface(spec, {"TestMethod": 1})
+        with pytest.warns(FutureWarning):
+            assert interface.make_interface(spec, {"TestMethod": 1}) is iface
+
+    def test_cached_parameter_warning(self):
+        def spec():
+            return {
+                "name": "TestInterfaceOne",
+                "methods": [
+                    {
+                        "name": "TestMethod",
+                        "version": 1,
+                        "httpmethod": "GET",
+                        "parameters": [
+                            {
+                                "name": "test",
+                                "type": "unknown",
+                                "optional": False,
+                            },
+                        ],
+                    },
+                ],
+            }
+
+        with pytest.warns(FutureWarning, match="No parameter type handler"):
+            iface = interface.make_interface(spec(), {})
+        with pytest.warns(FutureWarning, match="No parameter type handler"):
+            assert interface.make_interface(spec(), {}) is iface
+
+    def test_cache_bounded(self, monkeypatch):
+        method = mock.Mock()
+        method.name = "TestMethod"
+        method.version = 1
+        monkeypatch.setattr(interface,
+                            "make_method", mock.Mock(return_value=method))
+        monkeypatch.setattr(interface, "_INTERFACE_CACHE_SIZE", 1)
+
+        def spec(name):
+            return {
+                "name": name,
+                "methods": [
+                    {
+                        "name": "TestMethod",
+                        "version": 1,
+                    },
+                ],
+            }
+
+        iface = interface.make_interface(spec("TestInterfaceOne"), {})
+        interface.make_interface(spec("TestInterfaceTwo"), {})
+        assert len(interface._INTERFACE_CACHE) == 1
+        assert interface.make_interface(
+            spec("TestInterfaceOne"), {}) is not iface
+        assert interface.make_method.call_count == 3
+
 
 class TestMethodParameters(object):
 
@@ -280,6 +477,43 @@ class TestMethodParameters(object):
         ])
         assert params.validate(test=None) == {}
 
+    def test_validate_positional(self):
+        params = interface._MethodParameters([
+            {
+                "name": "aardvark",
+                "type": "string",
+                "optional": True,
+                "description": "test parameter",
+            },
+            {
+                "name": "zebra",
+                "type": "string",
+                "optional": False,
+                "description": "test parameter",
+            },
+        ])
+        assert params.validate("foo", "bar") == {
+            "zebra": "foo", "aardvark": "bar"}
+        assert params.validate("foo", aardvark="bar") == {
+            "zebra": "foo", "aardvark": "bar"}
+
+    @pytest.mark.parametrize(("args", "kwargs"), [
+        (("foo", "bar"), {}),
+        (("foo",), {"test": "bar"}),
+        ((), {"test": "foo", "unknown": "bar"}),
+    ])
+    def test_validate_bad_arguments(self, args, kwargs):
+        params = interface._MethodParameters([
+            {
+                "name": "test",
+                "type": "string",
+                "optional": False,
+                "description": "test parameter",
+            },
+        ])
+        with pytest.raises(TypeError):
+            params.validate(*args, **kwargs)
+
     def test_validate_type_conversion(self, monkeypatch):
         validator = mock.Mock()
         monkeypatch.setattr(interface,
@@ -319,23 +553,85 @@ def test_make_method():
         ],
     })
     assert method.__name__ == "test"
+    if six.PY3:
+        assert method.__qualname__ == "test"
     assert method.name == "test"
     assert method.version == 1
     assert method.__doc__ == textwrap.dedent("""\
         :param string bar: bar docs
         :param string foo: foo docs""")
-    assert method.__defaults__ == (None,)
+    if six.PY3:
+        assert str(inspect.signature(method)) == "(self, foo, bar=None)"
     iface = mock.Mock()
+    iface.name = "TestInterface"
     method(iface, "foo")
-    assert iface._request.called
-    assert iface._request.call_args[0][0] == "GET"
-    assert iface._request.call_args[0][1] == "test"
-    assert iface._request.call_args[0][2] == 1
-    assert iface._request.call_args[0][3] == {"foo": "foo"}
+    request = iface._api.request
+    assert request.called
+    assert request.call_args[0][0] == "GET"
+    assert request.call_args[0][1] == "TestInterface"
+    assert request.call_args[0][2] == "test"
+    assert request.call_args[0][3] == 1
+    assert request.call_args[0][4] == {"foo": "foo"}
+    method(iface, "foo", "bar")
+    assert request.call_args[0][4] == {"foo": "foo", "bar": "bar"}
+    method(iface, bar="bar", foo="foo")
+    assert request.call_args[0][4] == {"foo": "foo", "bar": "bar"}
+    with pytest.raises(TypeError):
+        method(iface)
+    with pytest.raises(TypeError):
+        method(iface, "foo", "bar", "baz")
+
+
+def test_make_method_no_params():
+    method = interface.make_method({
+        "name": "test",
+        "version": 1,
+        "httpmethod": "GET",
+        "parameters": [],
+    })
+    assert method.__doc__ is None
+    if six.PY3:
+        assert str(inspect.signature(method)) == "(self)"
+    iface = mock.Mock()
+    iface.name = "TestInterface"
+    method(iface)
+    assert iface._api.request.call_args[0] == (
+        "GET", "TestInterface", "test", 1, {})
+    with pytest.raises(TypeError) as excinfo:
+        method(iface, "foo")
+    assert "<locals>" not in str(excinfo.value)
+
+
+def test_make_method_only_optional_params():
+    method = interface.make_method({
+        "name": "test",
+        "version": 1,
+        "httpmethod": "GET",
+        "parameters": [
+            {
+                "name": "foo",
+                "type": "uint32",
+                "optional": True,
+                "description": "foo docs",
+            },
+        ],
+    })
+    iface = mock.Mock()
+    iface.name = "TestInterface"
+    method(iface)
+    assert iface._api.request.call_args[0] == (
+        "GET", "TestInterface", "test", 1, {})
+    method(iface, "1")
+    assert iface._api.request.call_args[0] == (
+        "GET", "TestInterface", "test", 1, {"foo": 1})
 
 
 class TestAPI(object):
 
+    @pytest.fixture(autouse=True)
+    def no_api_list_cache(self, monkeypatch):
+        monkeypatch.setattr(interface.API, "api_list_cache_dir", None)
+
     @pytest.fixture
     def interfaces(self):
         module = types.ModuleType(str("test"))
@@ -366,6 +662,50 @@ class TestAPI(object):
         assert api.request.call_args[1]["format"] is interface.json_format
         assert api._bind_interfaces.called
 
+    def test_http2(self, monkeypatch, interfaces):
+        httpx = mock.Mock()
+        monkeypatch.setattr(interface, "httpx", httpx)
+        api = interface.API(interfaces=interfaces, http2=True)
+        assert api._session is httpx.Client.return_value
+        assert httpx.Client.call_args[1] == {"http2": True, "timeout": None}
+
+    def test_request_transports_encode_alike(self, monkeypatch, interfaces):
+        httpx = interface.httpx
+        if httpx is None:
+            pytest.skip("httpx is not installed")
+        params = {"flag": True, "raw": b"\x01a\xffb"}
+        urls = []
+
+        def send(session, prepared, **kwargs):
+            urls.append(prepared.url)
+            return mock.Mock(content=b"{}")
+
+        def handler(request):
+            urls.append(str(request.url))
+            return httpx.Response(200, content=b"{}")
+
+        monkeypatch.setattr(interface.requests.Session, "send", send)
+        api = interface.API(interfaces=interfaces)
+        api.request("GET", "interface", "method", 1, dict(params))
+        api = interface.API(
+            interfaces=interfaces,
+            _session=httpx.Client(transport=httpx.MockTransport(handler)),
+        )
+        api.request("GET", "interface", "method", 1, dict(params))
+        expected = interface.requests.Request(
+            "GET",
+            api.api_root + "interface/method/v1/",
+            params=dict(params, format="json"),
+        ).prepare().url
+        assert urls == [expected, expected]
+        assert "flag=True" in expected
+        assert "raw=%01a%FFb" in expected
+
+    def test_http2_missing_httpx(self, monkeypatch, interfaces):
+        monkeypatch.setattr(interface, "httpx", None)
+        with pytest.raises(ImportError):
+            interface.API(interfaces=interfaces, http2=True)
+
     def test_inherit_interfaces(self, monkeypatch):
         monkeypatch.setattr(interface, "make_interfaces", mock.Mock())
         monkeypatch.setattr(interface.API, "_bind_interfaces", mock.Mock())
@@ -377,11 +717,60 @@ class TestAPI(object):
         assert api._bind_interfaces.called
         assert not api.request.called
 
+    def test_api_list_cache(self, monkeypatch, tmpdir):
+        cache_dir = str(tmpdir.join("cache"))
+        monkeypatch.setattr(interface, "make_interfaces", mock.Mock())
+        monkeypatch.setattr(interface.API, "_bind_interfaces", mock.Mock())
+        monkeypatch.setattr(interface.API, "api_list_cache_dir", cache_dir)
+        monkeypatch.setattr(interface.API, "request",
+                            mock.Mock(return_value={"apilist": {}}))
+        interface.API()
+        assert interface.API.request.call_count == 1
+        assert interface.make_interfaces.call_args[0][0] == {"apilist": {}}
+        interface.API()
+        assert interface.API.request.call_count == 1
+        assert interface.make_interfaces.call_args[0][0] == {"apilist": {}}
+        interface.API(key="key")
+        assert interface.API.request.call_count == 2
+        assert len(tmpdir.join("cache").listdir()) == 2
+
+    def test_api_list_cache_api_root(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(interface, "make_interfaces", mock.Mock())
+        monkeypatch.setattr(interface.API, "_bind_interfaces", mock.Mock())
+        monkeypatch.setattr(interface.API, "api_list_cache_dir", str(tmpdir))
+        monkeypatch.setattr(interface.API, "request",
+                            mock.Mock(return_value={"apilist": {}}))
+
+        class PartnerAPI(interface.API):
+            api_root = "https://partner.steam-api.com/"
+
+        interface.API(key="key")
+        PartnerAPI(key="key")
+        assert interface.API.request.call_count == 2
+        assert len(tmpdir.listdir()) == 2
+
+    def test_api_list_cache_expired(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(interface, "make_interfaces", mock.Mock())
+        monkeypatch.setattr(interface.API, "_bind_interfaces", mock.Mock())
+        monkeypatch.setattr(interface.API, "api_list_cache_dir", str(tmpdir))
+        monkeypatch.setattr(interface.API, "api_list_cache_ttl", -1)
+        monkeypatch.setattr(interface.API, "request",
+                            mock.Mock(return_value={"apilist": {}}))
+        interface.API()
+        interface.API()
+        assert interface.API.request.call_count == 2
+
     def test_getitem(self):
         api = interface.API(interfaces=types.ModuleType(str("test")))
         api._interfaces = mock.MagicMock()
-        assert api["Test"] is api._interfaces.__getitem__.return_value
-        assert api._interfaces.__getitem__.call_args[0][0] == "Test"
+        assert api["Test"] is api._interfaces.get.return_value
+        assert api._interfaces.get.call_args[0][0] == "Test"
+
+    def test_getitem_unknown(self, interfaces):
+        api = interface.API(interfaces=interfaces)
+        with pytest.raises(KeyError) as excinfo:
+            api["Unknown"]
+        assert getattr(excinfo.value, "__context__", None) is None
 
     def test_bind_interfaces(self, interfaces):
         interfaces.NotSubClass = type(str("NotSubClass"), (), {})
@@ -391,6 +780,13 @@ class TestAPI(object):
         with pytest.raises(KeyError):
             api["NotSubClass"]
 
+    def test_bind_interfaces_lazy(self, interfaces):
+        api = interface.API(interfaces=interfaces)
+        assert api._interfaces == {}
+        iface = api["TestInterface"]
+        assert api._interfaces == {"TestInterface": iface}
+        assert api["TestInterface"] is iface
+
     def test_request(self, interfaces):
         api = interface.API(interfaces=interfaces)
         api._session = mock.Mock()
@@ -400,10 +796,11 @@ class TestAPI(object):
         response = api.request("GET", "interface", "method",
                                1, params={"key": "test", "foo": "bar"})
         assert api.format.called
-        assert api.format.call_args[0][0] is raw_response.text
+        assert api.format.call_args[0][0] is raw_response.content
         assert request.call_args[0][0] == "GET"
-        assert request.call_args[0][1] == api.api_root + "interface/method/v1/"
-        assert request.call_args[0][2] == {"format": "json", "foo": "bar"}
+        url, query = request.call_args[0][1].split("?")
+        assert url == api.api_root + "interface/method/v1/"
+        assert dict(parse_qsl(query)) == {"format": "json", "foo": "bar"}
 
     @pytest.mark.parametrize("format_", ["json", "xml", "vdf"])
     def test_request_with_key(self, interfaces, format_):
@@ -415,29 +812,65 @@ class TestAPI(object):
         response = api.request("GET", "interface", "method",
                                1, params={"key": "test", "foo": "bar"})
         assert api.format.called
-        assert api.format.call_args[0][0] is raw_response.text
+        assert api.format.call_args[0][0] is raw_response.content
         assert request.call_args[0][0] == "GET"
-        assert request.call_args[0][1] == api.api_root + "interface/method/v1/"
-        assert request.call_args[0][2] == {
+        url, query = request.call_args[0][1].split("?")
+        assert url == api.api_root + "interface/method/v1/"
+        assert dict(parse_qsl(query)) == {
             "key": "key",
             "format": format_,
             "foo": "bar",
         }
 
+    def test_unhashable_format(self, interfaces):
+
+        class Formatter(object):
+            format = "json"
+
+            def __eq__(self, other):
+                return self is other
+
+            __hash__ = None
+
+            def __call__(self, response):
+                return response
+
+        formatter = Formatter()
+        api = interface.API(interfaces=interfaces, format=formatter)
+        assert api.format is formatter
+
+    def test_unknown_format(self, interfaces):
+        with pytest.raises(ValueError):
+            interface.API(interfaces=interfaces,
+                          format=mock.Mock(format="invalid"))
+
     def test_request_unknown_format(self, interfaces):
         api = interface.API(interfaces=interfaces)
         api._session = mock.Mock()
-        api.format = mock.Mock(format="invalid")
-        request = api._session.request
-        raw_response = request.return_value
         with pytest.raises(ValueError):
-            api.request("GET", "interface", "method", 1)
+            api.request("GET", "interface", "method",
+                        1, format=mock.Mock(format="invalid"))
+        assert not api._session.request.called
+
+    def test_session(self, monkeypatch, interfaces):
+        monkeypatch.setattr(interface.API, "request", mock.Mock())
+        api = interface.API(key="key", interfaces=interfaces)
+        with api.session() as session:
+            assert session is not api
+            assert session.key == "key"
+            assert session.format is api.format
+            assert session._interfaces_module is interfaces
+            assert session._session is api._session
+        assert not api.request.called
 
     def test_iter(self, interfaces):
         api = interface.API(interfaces=interfaces)
         foo = object()
         bar = object()
-        api._interfaces = {"foo": foo, "bar": bar}
+        api._interface_classes = {
+            "foo": mock.Mock(return_value=foo),
+            "bar": mock.Mock(return_value=bar),
+        }
         list_ = list(api)
         assert len(list_) == 2
         assert foo in list_
@@ -456,9 +889,9 @@ class TestAPI(object):
         ibar_meths = [mock.Mock(version=1)]
         ibar_meths[0].name = "method"
         ibar.__iter__ = lambda i: iter(ibar_meths)
-        api._interfaces = {
-            "ifoo": ifoo,
-            "ibar": ibar,
+        api._interface_classes = {
+            "ifoo": mock.Mock(return_value=ifoo),
+            "ibar": mock.Mock(return_value=ibar),
         }
         assert api.versions() == {
             "ifoo": {"eggs": 1, "spam": 2},
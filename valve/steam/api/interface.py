@@ -7,21 +7,56 @@ from __future__ import (absolute_import,
 import collections
 import contextlib
 import functools
+import hashlib
+import inspect
+import io
 import json
+import os
+import re
 import string
-import textwrap
+import sys
+import tempfile
+import threading
+import time
 import types
 import warnings
 import xml.etree.ElementTree as etree
 
+import appdirs
 import requests
 import six
+from six.moves.urllib.parse import urlencode
+try:
+    import httpx
+except ImportError:
+    httpx = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
 
 from ... import vdf
 
 
 API_RESPONSE_FORMATS = {"json", "vdf", "xml"}
 
+# simdjson parsers recycle their internal buffers between documents but
+# can only hold a single document at a time, so each thread gets its own.
+_SIMDJSON_PARSERS = threading.local()
+
+# Interface classes and the warnings raised while building them, keyed by a
+# fingerprint of their specification and pinned method versions. See
+# make_interface(). Refreshed API lists and different pins add new entries,
+# so once the cache holds _INTERFACE_CACHE_SIZE classes the oldest ones are
+# evicted. A single API list has a few hundred interfaces at most.
+_INTERFACE_CACHE = collections.OrderedDict()
+_INTERFACE_CACHE_LOCK = threading.Lock()
+_INTERFACE_CACHE_SIZE = 2048
+
 
 def api_response_format(format):
     if format not in API_RESPONSE_FORMATS:
@@ -39,12 +74,39 @@ def api_response_format(format):
     return decorator
 
 
+def _check_response_format(formatter):
+    """Ensure a response formatter handles a supported format
+
+    :raises ValueError: if the formatter's ``format`` attribute is not one
+        of those in :data:`API_RESPONSE_FORMATS`.
+    """
+    if formatter.format not in API_RESPONSE_FORMATS:
+        raise ValueError("Response formatter specifies its format as "
+                         "{!r}, but only 'json', 'xml' and 'vdf' "
+                         "are permitted values".format(formatter.format))
+
+
 @api_response_format("json")
 def json_format(response):
-    """Parse response as JSON using the standard Python JSON parser
+    """Parse response as JSON
+
+    The fastest available parser is used. In order of preference these are
+    `pysimdjson <https://pypi.org/project/pysimdjson/>`_,
+    `orjson <https://pypi.org/project/orjson/>`_ and then the standard
+    Python JSON parser.
 
+    :param response: the UTF-8 encoded response body.
     :return: the JSON object encoded in the response.
     """
+    if simdjson is not None:
+        parser = getattr(_SIMDJSON_PARSERS, "parser", None)
+        if parser is None:
+            parser = _SIMDJSON_PARSERS.parser = simdjson.Parser()
+        return parser.parse(response, True)
+    if orjson is not None:
+        return orjson.loads(response)
+    if isinstance(response, bytes):
+        response = response.decode("utf-8")
     return json.loads(response)
 
 
@@ -52,6 +114,9 @@ def json_format(response):
 def etree_format(response):
     """Parse response using ElementTree
 
+    The encoding of the response is determined by the XML declaration.
+
+    :param response: the response body.
     :return: a :class:`xml.etree.ElementTree.Element` of the root element of
         the response.
     """
@@ -62,15 +127,33 @@ def etree_format(response):
 def vdf_format(response):
     """Parse response using :mod:`valve.vdf`
 
+    :param response: the UTF-8 encoded response body.
     :return: a dictionary decoded from the VDF.
     """
+    if isinstance(response, bytes):
+        response = response.decode("utf-8")
     return vdf.loads(response)
 
 
+_FORMATTERS = {
+    "json": json_format,
+    "xml": etree_format,
+    "vdf": vdf_format,
+}
+
+
+_UINT32_MAX = 2 ** 32 - 1
+_UINT64_MAX = 2 ** 64 - 1
+_INT32_MIN = -2 ** 31
+_INT32_MAX = 2 ** 31 - 1
+
+
 def uint32(value):
     """Validate a 'unit32' method parameter type"""
+    if type(value) is int and 0 <= value <= _UINT32_MAX:
+        return value
     value = int(value)
-    if value > 4294967295:
+    if value > _UINT32_MAX:
         raise ValueError("{} exceeds upper bound for uint32".format(value))
     if value < 0:
         raise ValueError("{} below lower bound for uint32".format(value))
@@ -79,8 +162,10 @@ def uint32(value):
 
 def uint64(value):
     """Validate a 'unit64' method parameter type"""
+    if type(value) is int and 0 <= value <= _UINT64_MAX:
+        return value
     value = int(value)
-    if value > 18446744073709551615:
+    if value > _UINT64_MAX:
         raise ValueError("{} exceeds upper bound for uint64".format(value))
     if value < 0:
         raise ValueError("{} below lower bound for uint64".format(value))
@@ -90,10 +175,11 @@ def uint64(value):
 def int32(value):
     """Validate a 'int32' method parameter type"""
     value = int(value)
-    if value > 2147483647:
+    if value > _INT32_MAX:
         raise ValueError("{} exceeds upper bound for int32".format(value))
-    if value < -2147483648:
+    if value < _INT32_MIN:
         raise ValueError("{} below lower bound for int32".format(value))
+    return value
 
 
 PARAMETER_TYPES = {
@@ -111,10 +197,6 @@ class BaseInterface(object):
     def __init__(self, api):
         self._api = api
 
-    def _request(self, http_method, method, version, params):
-        return self._api.request(http_method,
-                                 self.name, method, version, params)
-
     def __iter__(self):
         """An iterator of all interface methods
 
@@ -123,6 +205,9 @@ class BaseInterface(object):
         raise NotImplementedError
 
 
+_NOT_IDENTIFIER = re.compile("[^0-9A-Za-z_]")
+
+
 def _ensure_identifier(name):
     """Convert ``name`` to a valid Python identifier
 
@@ -134,18 +219,19 @@ def _ensure_identifier(name):
     """
     # Note: the identifiers generated by this function must be safe
     # for use with eval()
-    identifier = "".join(char for char in name
-                       if char in string.ascii_letters + string.digits + "_")
-    try:
-        while identifier[0] not in string.ascii_letters + "_":
-            identifier = identifier[1:]
-    except IndexError:
+    identifier = _NOT_IDENTIFIER.sub("", name).lstrip(string.digits)
+    if not identifier:
         raise NameError(
             "Cannot form valid Python identifier from {!r}".format(name))
     return identifier
 
 
-class _MethodParameters(collections.OrderedDict):
+# Plain dictionaries only guarantee insertion order from Python 3.7 onwards
+_InsertionOrderedDict = (dict if sys.version_info >= (3, 7)
+                         else collections.OrderedDict)
+
+
+class _MethodParameters(_InsertionOrderedDict):
     """Represents the parameters accepted by a Steam API interface method
 
     Parameters are sorted alphabetically by their name.
@@ -171,8 +257,24 @@ class _MethodParameters(collections.OrderedDict):
                     "the future".format(spec["type"]), FutureWarning)
                 spec["type"] = "string"
             unordered[spec["name"]] = spec
-        super(_MethodParameters, self).__init__(
-            sorted(unordered.items(), key=lambda a: a[0]))
+        # Names are unique so the specs themselves are never compared
+        super(_MethodParameters, self).__init__(sorted(unordered.items()))
+        # The parameters don't change after this point so everything needed
+        # by the signature and validate() is worked out once up front
+        mandatory = []
+        optional = []
+        for param in self.values():
+            if param["optional"]:
+                optional.append(param["name"])
+            else:
+                mandatory.append(param["name"])
+        self._names = mandatory + optional
+        self._signature = ", ".join(
+            ["self"] + mandatory + [name + "=None" for name in optional])
+        self._validators = [
+            (param["name"], param["optional"], PARAMETER_TYPES[param["type"]])
+            for param in self.values()
+        ]
 
     @property
     def signature(self):
@@ -186,40 +288,52 @@ class _MethodParameters(collections.OrderedDict):
 
         Includes the leading 'self' argument.
         """
-        signature = ["self"]
-        optional = []
-        mandatory = []
-        for param in self.values():
-            if param["optional"]:
-                optional.append(param)
-            else:
-                mandatory.append(param)
-        signature.extend(param["name"] for param in mandatory)
-        signature.extend(param["name"] + "=None" for param in optional)
-        return ", ".join(signature)
+        return self._signature
 
-    def validate(self, **kwargs):
-        """Validate key-word arguments
+    @property
+    def names(self):
+        """Get the parameter names in the same order as :attr:`signature`
+
+        Excludes the leading 'self' argument.
+        """
+        return self._names
+
+    def validate(self, *args, **kwargs):
+        """Validate arguments
 
         Validates and coerces arguments to the correct type when making the
         HTTP request. Optional parameters which are not given or are set to
         None are not included in the returned dictionary.
 
-        :raises TypeError: if any mandatory arguments are missing.
+        Positional arguments are matched to parameters in the same order as
+        they appear in the :attr:`signature`.
+
+        :raises TypeError: if any mandatory arguments are missing or if the
+            arguments don't match the signature.
         :return: a dictionary of parameters to be sent with the method request.
         """
+        if args:
+            names = self._names
+            if len(args) > len(names):
+                raise TypeError("Expected at most {} positional arguments "
+                                "but got {}".format(len(names), len(args)))
+            for name, value in zip(names, args):
+                if name in kwargs:
+                    raise TypeError(
+                        "Multiple values for argument {!r}".format(name))
+                kwargs[name] = value
+        for name in kwargs:
+            if name not in self:
+                raise TypeError("Unexpected argument {!r}".format(name))
         values = {}
-        for arg in self.values():
-            value = kwargs.get(arg["name"])
+        for name, optional, validator in self._validators:
+            value = kwargs.get(name)
             if value is None:
-                if not arg["optional"]:
-                    # Technically the method signature protects against this
-                    # ever happening
+                if not optional:
                     raise TypeError(
-                        "Missing mandatory argument {!r}".format(arg["name"]))
-                else:
-                    continue
-            values[arg["name"]] = PARAMETER_TYPES[arg["type"]](value)
+                        "Missing mandatory argument {!r}".format(name))
+                continue
+            values[name] = validator(value)
         return values
 
 
@@ -240,28 +354,48 @@ def make_method(spec):
     spec["name"] = _ensure_identifier(spec["name"])
     args = _MethodParameters(spec["parameters"])
 
-    def method(self, **kwargs):
-        return self._request(spec["httpmethod"], spec["name"],
-                             spec["version"], args.validate(**kwargs))
-
-    # Do some eval() voodoo so we can rewrite the method signature. Otherwise
-    # when something like autodoc sees it, it'll just output f(**kwargs) which
-    # is really lame. _ensure_identifiers sanitises the function and
-    # argument names it's safe.
-    eval_globals = {}
-    code = compile(
-        textwrap.dedent("""
-            def {}({}):
-                return method(**locals())
-            """.format(spec["name"], args.signature)),
-        "<voodoo>",
-        "exec",
-    )
-    eval(code, {"method": method}, eval_globals)
-    method = eval_globals[spec["name"]]
+    # Bind everything needed per call to closure variables up front to
+    # avoid repeated lookups in the spec when the method is called
+    all_optional = all(param["optional"] for param in args.values())
+    http_method = spec["httpmethod"]
+    method_name = spec["name"]
+    version = spec["version"]
+    validate = args.validate
+
+    if args:
+        def method(self, *positional, **kwargs):
+            if all_optional and not positional and not kwargs:
+                params = {}
+            else:
+                params = validate(*positional, **kwargs)
+            return self._api.request(http_method, self.name,
+                                     method_name, version, params)
+    else:
+        # Nothing to validate, and the signature is already correct
+        def method(self):
+            return self._api.request(http_method, self.name,
+                                     method_name, version, {})
+
+    # Advertise the real method signature. Otherwise when something like
+    # autodoc sees it, it'll just output f(*positional, **kwargs) which is
+    # really lame. Python 2 has no equivalent so it's stuck with that.
+    if args and six.PY3:
+        parameters = [inspect.Parameter(
+            "self", inspect.Parameter.POSITIONAL_OR_KEYWORD)]
+        for name in args.names:
+            parameters.append(inspect.Parameter(
+                name,
+                inspect.Parameter.POSITIONAL_OR_KEYWORD,
+                default=None if args[name]["optional"]
+                else inspect.Parameter.empty,
+            ))
+        method.__signature__ = inspect.Signature(parameters)
     method.version = spec["version"]
     method.name = spec["name"]
     method.__name__ = spec["name"] if six.PY3 else bytes(spec["name"])
+    if six.PY3:
+        # Otherwise reprs and argument errors refer to make_method's closure
+        method.__qualname__ = spec["name"]
     param_docs = []
     for arg, param_spec in args.items():
         param_docs.append(
@@ -285,6 +419,49 @@ def make_interface(spec, versions):
         response to a ``ISteamWebAPIUtil/GetSupportedAPIList/v1`` request.
     :param versions: a dictionary of method versions to use for the interface.
     """
+    # Building the methods is expensive, so interface classes are reused
+    # when the same specification is seen again, e.g. by another API
+    # instance in the same process. The key must cover everything the
+    # built class depends on, including the docstrings.
+    cache_key = (
+        spec["name"],
+        tuple((method_spec["name"],
+               method_spec["version"],
+               method_spec.get("httpmethod"),
+               tuple((param["name"],
+                      param["type"],
+                      param["optional"],
+                      param.get("description", ""))
+                     for param in method_spec.get("parameters", ())))
+              for method_spec in spec["methods"]),
+        tuple(sorted(versions.items())),
+    )
+    with _INTERFACE_CACHE_LOCK:
+        cached = _INTERFACE_CACHE.get(cache_key)
+    if cached is None:
+        # Record the warnings raised while building so each API instance
+        # sees them, not just the first one to build the interface
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            interface = _build_interface(spec, versions)
+        cached = (interface, [(warning.message, warning.category,
+                               warning.filename, warning.lineno)
+                              for warning in caught])
+        with _INTERFACE_CACHE_LOCK:
+            _INTERFACE_CACHE[cache_key] = cached
+            while len(_INTERFACE_CACHE) > _INTERFACE_CACHE_SIZE:
+                _INTERFACE_CACHE.popitem(last=False)
+    interface, caught = cached
+    for message, category, filename, lineno in caught:
+        warnings.warn_explicit(message, category, filename, lineno)
+    return interface
+
+
+def _build_interface(spec, versions):
+    """Build an interface class without consulting the cache
+
+    See :func:`make_interface` for details.
+    """
     methods = {}
     max_versions = {}
     attrs = {"name": spec["name"],
@@ -351,26 +528,36 @@ class API(object):
 
     api_root = "https://api.steampowered.com/"
 
-    def __init__(self, key=None, format="json", versions=None, interfaces=None):
+    #: Directory where ``GetSupportedAPIList`` responses are cached or
+    #: ``None`` to disable caching.
+    api_list_cache_dir = appdirs.user_cache_dir("python-valve")
+
+    #: Number of seconds a cached ``GetSupportedAPIList`` response is used
+    #: for before it's requested again.
+    api_list_cache_ttl = 24 * 60 * 60
+
+    def __init__(self, key=None, format="json",
+                 versions=None, interfaces=None, http2=False, _session=None):
         """Initialise an API wrapper
 
         The API is usable without an API key but exposes significantly less
         functionality, therefore it's advisable to use a key.
 
-        Response formatters are callables which take the Unicode response from
-        the Steam Web API and turn it into a more usable Python object, such as
-        dictionary. The Steam API it self can generate responses in either
-        JSON, XML or VDF. The formatter callables should have an attribute
-        ``format`` which is a string indicating which textual format they
-        handle. For convenience the ``format`` parameter also accepts the
-        strings ``json``, ``xml`` and ``vdf`` which are mapped to the
-        :func:`json_format`, :func:`etree_format` and :func:`vdf_format`
-        formatters respectively.
+        Response formatters are callables which take the raw response body
+        from the Steam Web API as bytes and turn it into a more usable Python
+        object, such as dictionary. The Steam API it self can generate
+        responses in either JSON, XML or VDF. The formatter callables should
+        have an attribute ``format`` which is a string indicating which
+        textual format they handle. For convenience the ``format`` parameter
+        also accepts the strings ``json``, ``xml`` and ``vdf`` which are
+        mapped to the :func:`json_format`, :func:`etree_format` and
+        :func:`vdf_format` formatters respectively.
 
         The ``interfaces`` argument can optionally be set to a module
         containing :class:`BaseInterface` subclasses which will be instantiated
         and bound to the :class:`API` instance. If not given then the
         interfaces are loaded using ``ISteamWebAPIUtil/GetSupportedAPIList``.
+        The response to which is cached on disk, see :meth:`_load_api_list`.
 
         The optional ``versions`` argument allows specific versions of interface
         methods to be used. If given, ``versions`` should be a mapping of
@@ -380,50 +567,123 @@ class API(object):
         can omit methods or even entire interfaces. In which case the default
         behaviour is to use the method with the highest version number.
 
+        By default requests are issued using a :class:`requests.Session`.
+        If ``http2`` is set then an :class:`httpx.Client` with HTTP/2 enabled
+        is used instead, which allows requests made from multiple threads to
+        be multiplexed over a single connection. This requires the optional
+        `httpx <https://www.python-httpx.org/>`_ dependency. Like the
+        default session, the HTTP/2 client has no timeout.
+
         :param str key: a Steam Web API key.
         :param format: response formatter.
         :param versions: the interface method versions to use.
         :param interfaces: a module containing :class:`BaseInterface`
             subclasses or ``None`` if they should be loaded for the first time.
+        :param bool http2: whether to use HTTP/2.
+        :raises ValueError: if the response formatter's format is not one of
+            those in :data:`API_RESPONSE_FORMATS`.
+        :raises ImportError: if ``http2`` is set but httpx isn't installed.
         """
         self.key = key
-        if format == "json":
-            format = json_format
-        elif format == "xml":
-            format = etree_format
-        elif format == "vdf":
-            format = vdf_format
+        if isinstance(format, six.string_types):
+            format = _FORMATTERS.get(format, format)
         self.format = format
-        self._session = requests.Session()
+        _check_response_format(self.format)
+        if _session is not None:
+            # Shared with the parent API, see session()
+            self._session = _session
+        elif http2:
+            if httpx is None:
+                raise ImportError("HTTP/2 support requires httpx; install "
+                                  "it with 'pip install python-valve[http2]'")
+            # httpx defaults to a five second timeout whereas requests
+            # has none, so match requests
+            self._session = httpx.Client(http2=True, timeout=None)
+        else:
+            self._session = requests.Session()
         if interfaces is None:
             self._interfaces_module = make_interfaces(
-                self.request("GET", "ISteamWebAPIUtil",
-                             "GetSupportedAPIList", 1, format=json_format),
-                versions or {},
-            )
+                self._load_api_list(), versions or {})
         else:
             self._interfaces_module = interfaces
         self._bind_interfaces()
 
     def __getitem__(self, interface_name):
-        """Get an interface instance by name"""
-        return self._interfaces[interface_name]
+        """Get an interface instance by name
+
+        Interfaces are instantiated the first time they're requested.
+
+        :raises KeyError: if there is no interface with the given name.
+        """
+        interface = self._interfaces.get(interface_name)
+        if interface is None:
+            interface = self._interface_classes[interface_name](self)
+            self._interfaces[interface_name] = interface
+        return interface
+
+    def _load_api_list(self):
+        """Get the list of supported interfaces
+
+        The response to ``ISteamWebAPIUtil/GetSupportedAPIList`` is cached
+        as JSON in :attr:`api_list_cache_dir` for up to
+        :attr:`api_list_cache_ttl` seconds. As the available interfaces
+        depend on the API key and :attr:`api_root`, each combination of the
+        two has its own cache file. Failing to read or write the cache is
+        not an error; the list is requested from the API instead.
+
+        :return: the JSON-decoded ``GetSupportedAPIList`` response.
+        """
+        if self.api_list_cache_dir is None:
+            return self.request("GET", "ISteamWebAPIUtil",
+                                "GetSupportedAPIList", 1, format=json_format)
+        fingerprint = hashlib.sha1(
+            (self.api_root + "\0" + (self.key or "")).encode("utf-8"))
+        path = os.path.join(
+            self.api_list_cache_dir,
+            "apilist-{}.json".format(fingerprint.hexdigest()),
+        )
+        try:
+            if time.time() - os.path.getmtime(path) < self.api_list_cache_ttl:
+                with io.open(path, encoding="utf-8") as cache:
+                    return json.load(cache)
+        except (IOError, OSError, ValueError):
+            pass
+        api_list = self.request("GET", "ISteamWebAPIUtil",
+                                "GetSupportedAPIList", 1, format=json_format)
+        temporary = None
+        try:
+            if not os.path.isdir(self.api_list_cache_dir):
+                os.makedirs(self.api_list_cache_dir)
+            # Write to a temporary file first so that concurrent readers
+            # never see a partially written cache
+            descriptor, temporary = tempfile.mkstemp(
+                dir=self.api_list_cache_dir, suffix=".tmp")
+            with io.open(descriptor, "w", encoding="utf-8") as cache:
+                cache.write(six.text_type(json.dumps(api_list)))
+            getattr(os, "replace", os.rename)(temporary, path)
+        except (IOError, OSError):
+            if temporary is not None and os.path.exists(temporary):
+                os.remove(temporary)
+        return api_list
 
     def _bind_interfaces(self):
         """Bind all interfaces to this API instance
 
-        Instantiate all :class:`BaseInterface` subclasses in the
-        :attr:`_interfaces_module` with a reference to this :class:`API`
-        instance.
+        Finds all :class:`BaseInterface` subclasses in the
+        :attr:`_interfaces_module`. These are only instantiated with a
+        reference to this :class:`API` instance when first accessed via
+        :meth:`__getitem__`, as most programs only use a few of them.
 
-        Sets :attr:`_interfaces` to a dictionary mapping interface names to
-        corresponding instances.
+        Sets :attr:`_interface_classes` to a dictionary mapping interface
+        names to their classes and :attr:`_interfaces` to an initially empty
+        dictionary mapping interface names to corresponding instances.
         """
+        self._interface_classes = {}
         self._interfaces = {}
         for name, interface in self._interfaces_module.__dict__.items():
             try:
                 if issubclass(interface, BaseInterface):
-                    self._interfaces[name] = interface(self)
+                    self._interface_classes[name] = interface
             except TypeError:
                 # Not a class
                 continue
@@ -442,23 +702,28 @@ class API(object):
         :param params: a mapping of GET or POST data to be sent with the
             request.
         :param format: a response formatter callable to overide :attr:`format`.
+        :raises ValueError: if the overriding formatter's format is not one
+            of those in :data:`API_RESPONSE_FORMATS`.
         """
         if params is None:
             params = {}
         if format is None:
+            # Already checked by __init__
             format = self.format
+        else:
+            _check_response_format(format)
         path = "{interface}/{method}/v{version}/".format(**locals())
-        if format.format not in API_RESPONSE_FORMATS:
-            raise ValueError("Response formatter specifies its format as "
-                             "{!r}, but only 'json', 'xml' and 'vdf' "
-                             "are permitted values".format(format.format))
         params["format"] = format.format
         if "key" in params:
             del params["key"]
         if self.key:
             params["key"] = self.key
-        return format(self._session.request(http_method,
-                                            self.api_root + path, params).text)
+        # The query string is encoded here rather than by the session as
+        # requests and httpx encode bytes and booleans differently. This
+        # matches what requests does itself.
+        response = self._session.request(
+            http_method, self.api_root + path + "?" + urlencode(params))
+        return format(response.content)
 
     @contextlib.contextmanager
     def session(self):
@@ -467,14 +732,17 @@ class API(object):
         This returns a context manager which yields a new :class:`API` instance
         with the same interfaces as the current one. The difference between
         this and creating a new :class:`API` manually is that this will avoid
-        rebuilding the all interface classes which can be slow.
+        rebuilding the all interface classes which can be slow. The new
+        instance also shares this instance's HTTP session so open
+        connections to the Steam Web API are reused.
         """
-        yield API(self.key, self.format, self._interfaces_module)
+        yield API(self.key, self.format,
+                  interfaces=self._interfaces_module, _session=self._session)
 
     def __iter__(self):
         """An iterator of all bound API interfaces"""
-        for interface in self._interfaces.values():
-            yield interface
+        for name in self._interface_classes:
+            yield self[name]
 
     def versions(self):
         """Get the versions of the methods for each interface